@@ -4,14 +4,18 @@ YAML configuration parser for TracerX Marker Selection Pipeline
 Extracts configuration values and exports them as shell variables
 """
 
-import yaml
 import sys
 import os
+import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 def parse_config(config_file):
     """Parse YAML configuration and export as shell variables."""
     with open(config_file, 'r') as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=SafeLoader)
     
     # Extract configuration values with defaults
     patient_id = config.get('patient_id', 'UNKNOWN')
@@ -46,32 +50,35 @@ def parse_config(config_file):
     patient_base_dir = f"{base_dir}/{patient_id}"
     filtered_ssm_file = f"{patient_base_dir}/initial/ssm_filtered.txt"
     
-    # Print shell variable exports
-    print(f'export PATIENT_ID="{patient_id}"')
-    print(f'export INPUT_SSM_FILE="{ssm_file}"')
-    print(f'export FILTERED_SSM_FILE="{filtered_ssm_file}"')
-    print(f'export CODE_DIR="{code_dir}"')
-    print(f'export PATIENT_BASE_DIR="{patient_base_dir}"')
-    print(f'export NUM_BOOTSTRAPS="{num_bootstraps}"')
-    print(f'export NUM_CHAINS="{num_chains}"')
-    print(f'export ARRAY_LIMIT="{array_limit}"')
-    print(f'export READ_DEPTH="{read_depth}"')
+    # Collect shell variable exports and emit them in a single write
+    lines = []
+    lines.append(f'export PATIENT_ID="{patient_id}"')
+    lines.append(f'export INPUT_SSM_FILE="{ssm_file}"')
+    lines.append(f'export FILTERED_SSM_FILE="{filtered_ssm_file}"')
+    lines.append(f'export CODE_DIR="{code_dir}"')
+    lines.append(f'export PATIENT_BASE_DIR="{patient_base_dir}"')
+    lines.append(f'export NUM_BOOTSTRAPS="{num_bootstraps}"')
+    lines.append(f'export NUM_CHAINS="{num_chains}"')
+    lines.append(f'export ARRAY_LIMIT="{array_limit}"')
+    lines.append(f'export READ_DEPTH="{read_depth}"')
     # Note: Filter strategy and threshold exports removed - handled in bootstrap stage
     
     # HPC settings for each step
     for step in ['bootstrap', 'phylowgs', 'aggregation', 'marker_selection']:
         step_config = hpc_config.get(step, {})
         step_upper = step.upper()
-        print(f'export {step_upper}_PARTITION="{step_config.get("partition", "pool1")}"')
-        print(f'export {step_upper}_CPUS="{step_config.get("cpus_per_task", 1)}"')
-        print(f'export {step_upper}_MEMORY="{step_config.get("memory", "8G")}"')
-        print(f'export {step_upper}_WALLTIME="{step_config.get("walltime", "02:00:00")}"')
-        print(f'export {step_upper}_CONDA_ENV="{step_config.get("conda_env", "base")}"')
+        lines.append(f'export {step_upper}_PARTITION="{step_config.get("partition", "pool1")}"')
+        lines.append(f'export {step_upper}_CPUS="{step_config.get("cpus_per_task", 1)}"')
+        lines.append(f'export {step_upper}_MEMORY="{step_config.get("memory", "8G")}"')
+        lines.append(f'export {step_upper}_WALLTIME="{step_config.get("walltime", "02:00:00")}"')
+        lines.append(f'export {step_upper}_CONDA_ENV="{step_config.get("conda_env", "base")}"')
     
     # Special handling for modules
     marker_modules = hpc_config.get('marker_selection', {}).get('modules', [])
     if marker_modules:
-        print(f'export MARKER_SELECTION_MODULES="{" ".join(marker_modules)}"')
+        lines.append(f'export MARKER_SELECTION_MODULES="{" ".join(marker_modules)}"')
+
+    sys.stdout.write("\n".join(lines) + "\n")
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
@@ -112,10 +112,10 @@ def process_bootstrap_data(
         json.dump(results_dict, f)
     
     with open(aggregation_output_dir / f'{method}_bootstrap_summary.pkl', 'wb') as g:
-        pickle.dump(tree_distribution, g)
+        pickle.dump(tree_distribution, g, protocol=pickle.HIGHEST_PROTOCOL)
     
     with open(aggregation_output_dir / f'{method}_bootstrap_aggregation.pkl', 'wb') as g:
-        pickle.dump(tree_aggregation, g)
+        pickle.dump(tree_aggregation, g, protocol=pickle.HIGHEST_PROTOCOL)
 
     print(f"Aggregation results saved in {aggregation_output_dir}")
 
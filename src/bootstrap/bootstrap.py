@@ -1,8 +1,11 @@
-import pandas as pd
 import numpy as np
+import csv
+import hashlib
 import os
+import pickle
 import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
 """
@@ -18,298 +21,434 @@ The bootstrapping process for each mutation's samples:
 3. Repeats this process N times to create N bootstrapped SSM files.
 
 Usage: 
-python bootstrap.py -i <input_ssm_file> -o <output_directory> -n <number_of_bootstraps>
+python bootstrap.py -i <input_ssm_file> -o <output_directory> -n <number_of_bootstraps> [-j <num_workers>] [--seed <seed>]
 """
 
-def bootstrap_va_dt(AF_list, Depth_list, bootstrap_num):
+# Column order expected by PhyloWGS
+SSM_COLUMNS = ['id', 'gene', 'a', 'd', 'mu_r', 'mu_v']
+
+# Mutations per parallel bootstrap task
+BOOTSTRAP_CHUNK_SIZE = 256
+
+# Threads used to write bootstrapped SSM files
+BOOTSTRAP_WRITE_THREADS = 8
+
+
+def _bootstrap_kernel(vafs, depths, bootstrap_num, out_vaf, out_depth, rng):
     """
-    Advanced bootstrapping of both depths and allele frequencies for a single mutation across its samples.
-    
+    Bootstrap depths and VAFs for a block of mutations with one multinomial and one binomial call.
+
+    Generator.multinomial broadcasts per-mutation totals and pvals, so the whole block is
+    resampled in C without a Python loop over mutations.
+
     Args:
-        AF_list (list): List of variant allele frequencies for each sample of a mutation.
-        Depth_list (list): List of read depths for each sample of a mutation.
+        vafs (np.ndarray): VAFs (num_mutations, num_samples).
+        depths (np.ndarray): Integer read depths (num_mutations, num_samples).
         bootstrap_num (int): Number of bootstrap samples to generate.
-    
+        out_vaf (np.ndarray): Zero-initialised float array (num_mutations, num_samples, bootstrap_num).
+        out_depth (np.ndarray): Integer array (num_mutations, num_samples, bootstrap_num).
+        rng (np.random.Generator): Source of the multinomial/binomial draws.
+    """
+    # pvals for multinomial distribution of reads; mutations with zero total depth
+    # draw n=0 reads, so all their new depths (and VAFs) are zero
+    total_depth_sum = depths.sum(axis=1)
+    pvals = depths / np.maximum(total_depth_sum, 1)[:, np.newaxis]
+
+    # new_depths shape: (num_mutations, bootstrap_num, num_samples)
+    new_depths = rng.multinomial(n=total_depth_sum[:, np.newaxis],
+                                 pvals=pvals[:, np.newaxis, :],
+                                 size=(len(depths), bootstrap_num))
+
+    # Replace zero depths with 1 where the original depth was non-zero, instead of
+    # redrawing; the resulting bias is O(1/total_depth)
+    replacement_mask = (new_depths == 0) & (depths > 0)[:, np.newaxis, :]
+    new_depths[replacement_mask] = 1
+
+    # out_depth shape: (num_mutations, num_samples, bootstrap_num)
+    out_depth[:] = new_depths.transpose(0, 2, 1)
+
+    # Binomial sample of variant reads for every (mutation, sample, bootstrap) cell in one call;
+    # p is broadcast across the bootstrap axis
+    variant_reads = rng.binomial(n=out_depth,
+                                 p=np.broadcast_to(vafs[:, :, np.newaxis], out_depth.shape))
+
+    # VAF is left at 0 where depth is 0
+    np.divide(variant_reads, out_depth, out=out_vaf, where=out_depth > 0)
+
+
+def parse_count_column(count_column):
+    """
+    Parse a column of comma-separated read counts into a 2-D integer matrix.
+
+    Handles both single-sample (integer) and multi-sample (comma-separated string) formats.
+
+    Args:
+        count_column (np.ndarray): The 'a' or 'd' column of an SSM table (strings).
+
     Returns:
-        tuple: (bootstrapped_VAFs, bootstrapped_depths)
-               bootstrapped_VAFs is a NumPy array (num_samples, bootstrap_num)
-               bootstrapped_depths is a NumPy array (num_samples, bootstrap_num)
+        tuple: (counts, present)
+               counts is a float array (num_mutations, max_num_samples) of integer counts;
+               entries that are missing or could not be parsed as integers are NaN
+               present is a bool array marking which entries exist in the (ragged) input
     """
-    AF_array = np.array(AF_list)
-    Depth_array = np.array(Depth_list)
-    
-    # Ensure no zero depths in pvals for multinomial if total_depth > 0
-    # If a depth is 0, its pval should be 0. If all depths are 0, pvals sum to 0.
-    # np.random.multinomial handles pvals summing to < 1 by distributing the remainder.
-    # If sum(pvals) is 0 (all depths are 0), multinomial will fail.
-    total_depth_sum = np.sum(Depth_array)
-
-    # pvals for multinomial distribution of reads
-    if total_depth_sum == 0:
-        # If total depth is zero, all new depths will be zero.
-        # VAFs will be NaN or 0 depending on binomial sampling with 0 depth.
-        pvals = np.zeros_like(Depth_array, dtype=float)
-    else:
-        pvals = Depth_array / total_depth_sum
-
-    # Counter for attempts to get non-zero depths
-    count = 0
-    while True:
-        count += 1
-        # new_Depth_list_transposed shape: (bootstrap_num, num_samples)
-        if total_depth_sum == 0 :
-             new_Depth_list_transposed = np.zeros((bootstrap_num, len(Depth_array)), dtype=int)
-        else:
-            new_Depth_list_transposed = np.random.multinomial(n=int(total_depth_sum), 
-                                                              pvals=pvals, 
-                                                              size=bootstrap_num)
-        
-        # Break if no zero depths or if all original depths were zero
-        if not np.any(new_Depth_list_transposed == 0) or total_depth_sum == 0:
-            break
-            
-        # If attempts exceed threshold, replace zeros with 1s (if original depth > 0)
-        if count >= 10:
-            # Only replace where original depth was non-zero
-            mask_original_nonzero = Depth_array > 0
-            mask_new_zero = new_Depth_list_transposed == 0
-            # Apply replacement only where original was >0 and new is 0
-            replacement_mask = mask_new_zero & mask_original_nonzero[np.newaxis, :]
-            new_Depth_list_transposed[replacement_mask] = 1
-            break
-    
-    # AF_list_update shape: (num_samples, bootstrap_num)
-    AF_list_update = np.zeros((len(AF_list), bootstrap_num))
-    
-    # Transpose new_Depth_list for easier iteration: (num_samples, bootstrap_num)
-    new_Depth_list = new_Depth_list_transposed.T 
-
-    for i in range(len(AF_list)): # Iterate over samples
-        for j in range(bootstrap_num): # Iterate over bootstrap iterations
-            current_depth = new_Depth_list[i, j]
-            original_vaf = AF_list[i]
-            
-            if current_depth == 0:
-                AF_list_update[i, j] = 0 # Or np.nan, if preferred
-            else:
-                # Binomial sample for variant reads
-                variant_reads_sample = np.random.binomial(n=current_depth, 
-                                                          p=original_vaf, 
-                                                          size=1)[0]
-                AF_list_update[i, j] = variant_reads_sample / current_depth
-    
-    return AF_list_update, new_Depth_list
+    fields = [str(value).split(',') for value in count_column]
+    num_fields = np.fromiter(map(len, fields), dtype=int, count=len(fields))
+    width = num_fields.max() if len(fields) else 1
+    present = np.arange(width)[np.newaxis, :] < num_fields[:, np.newaxis]
+
+    tokens = np.array([row + [''] * (width - len(row)) for row in fields], dtype=str).reshape(len(fields), width)
+    counts = np.full(tokens.shape, np.nan)
+    try:
+        counts[present] = tokens[present].astype(np.int64)
+    except ValueError:
+        # Some entries are not integers: fall back to parsing token by token
+        counts[present] = [_parse_count(token) for token in tokens[present]]
+    return counts, present
+
+
+def _parse_count(token):
+    """Parse a single read count, returning NaN if it is not an integer."""
+    try:
+        return int(token)
+    except ValueError:
+        return np.nan
+
+
+def _pad_samples(counts, present, num_samples):
+    """Pad a (num_mutations, n) count matrix with missing entries up to num_samples columns."""
+    pad = num_samples - counts.shape[1]
+    if pad == 0:
+        return counts, present
+    return (np.pad(counts, ((0, 0), (0, pad)), constant_values=np.nan),
+            np.pad(present, ((0, 0), (0, pad)), constant_values=False))
+
+
+def parse_read_counts(input_ssm):
+    """
+    Parse and validate the 'a' and 'd' columns of an SSM table.
+
+    Args:
+        input_ssm (dict): Input SSM table (column name -> np.ndarray)
+
+    Returns:
+        tuple: (ref_counts, depth_counts, valid_samples, mismatch, unparsed)
+               ref_counts/depth_counts are float arrays (num_mutations, num_samples), NaN where missing
+               valid_samples marks samples passing the read count sanity check (0 <= a <= d)
+               mismatch marks mutations whose 'a' and 'd' have different sample counts
+               unparsed marks mutations with counts that could not be parsed as integers
+    """
+    ref_counts, ref_present = parse_count_column(input_ssm['a'])
+    depth_counts, depth_present = parse_count_column(input_ssm['d'])
+
+    # Pad both matrices to the same number of sample columns
+    num_samples = max(ref_counts.shape[1], depth_counts.shape[1])
+    ref_counts, ref_present = _pad_samples(ref_counts, ref_present, num_samples)
+    depth_counts, depth_present = _pad_samples(depth_counts, depth_present, num_samples)
+
+    mismatch = (ref_present != depth_present).any(axis=1)
+    unparsed = (np.isnan(ref_counts) & ref_present).any(axis=1) | (np.isnan(depth_counts) & depth_present).any(axis=1)
+    # NaN entries compare False, so missing/unparsed samples are never valid
+    valid_samples = (ref_counts >= 0) & (depth_counts >= 0) & (ref_counts <= depth_counts)
+    return ref_counts, depth_counts, valid_samples, mismatch, unparsed
+
+
+def _join_counts(counts, sample_mask):
+    """
+    Format each row of a (num_mutations, num_samples) count matrix as a comma-separated string.
+
+    Strings are built column by column with np.char.add, so the Python-level work scales
+    with the number of samples rather than the number of mutations. Samples outside
+    sample_mask are omitted from their row's string.
+    """
+    count_strs = np.where(sample_mask, counts.astype(str), '')
+    joined = count_strs[:, 0]
+    seen = sample_mask[:, 0]
+    for s in range(1, count_strs.shape[1]):
+        sep = np.where(seen & sample_mask[:, s], ',', '')
+        joined = np.char.add(np.char.add(joined, sep), count_strs[:, s])
+        seen = seen | sample_mask[:, s]
+    return joined
+
+def read_ssm_file(ssm_file_path):
+    """
+    Read a tab-separated SSM file into a table of string columns.
+
+    Args:
+        ssm_file_path (str): Path to the SSM file.
+
+    Returns:
+        dict: Column name -> np.ndarray of strings, in file column order
+    """
+    with open(ssm_file_path, 'r', newline='') as f:
+        # Blank lines are skipped, as pandas' read_csv does
+        reader = (row for row in csv.reader(f, delimiter='\t') if row)
+        header = next(reader, [])
+        rows = list(reader)
+
+    for row_num, row in enumerate(rows, 1):
+        if len(row) > len(header):
+            raise ValueError(f"Expected {len(header)} fields in data row {row_num}, saw {len(row)}")
+        if len(row) < len(header):
+            row.extend([''] * (len(header) - len(row)))
+
+    columns = zip(*rows) if rows else [()] * len(header)
+    return {name: np.array(column, dtype=object) for name, column in zip(header, columns)}
+
+
+def write_ssm_file(ssm_file_path, ssm_table):
+    """Write an SSM table (column name -> per-mutation values) as a tab-separated file."""
+    with open(ssm_file_path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(list(ssm_table))
+        writer.writerows(zip(*ssm_table.values()))
+
+
+def num_mutations_in(ssm_table):
+    """Number of rows in an SSM table."""
+    return len(next(iter(ssm_table.values()))) if ssm_table else 0
+
+
+def select_mutations(ssm_table, mask):
+    """Return the rows of an SSM table selected by a boolean mask."""
+    return {name: column[mask] for name, column in ssm_table.items()}
+
+
+def make_bootstrap_dirs(output_dir, num_bootstraps):
+    """
+    Create the bootstrap1..bootstrapN subdirectories of output_dir up front, each with
+    the empty cnv.txt required by PhyloWGS, so later SSM writes are pure file writes.
+    """
+    for i in range(1, num_bootstraps + 1):
+        bootstrap_sub_dir = Path(output_dir) / f'bootstrap{i}'
+        os.makedirs(bootstrap_sub_dir, exist_ok=True)
+        open(bootstrap_sub_dir / 'cnv.txt', 'wb').close()
+
 
 def write_bootstrapped_ssm_file(mutations_for_this_bootstrap_iter, bootstrap_iteration_num, output_dir):
     """
     Writes a single bootstrapped SSM file for a given bootstrap iteration.
     
     Args:
-        mutations_for_this_bootstrap_iter (list): List of dicts, each representing a mutation
-                                                  with its bootstrapped 'a' and 'd' values.
+        mutations_for_this_bootstrap_iter (dict): Column name -> per-mutation values, including
+                                                  the bootstrapped 'a' and 'd' strings.
         bootstrap_iteration_num (int): The 1-based number of this bootstrap iteration.
-        output_dir (str): The base directory to write bootstrap subdirectories.
+        output_dir (str): The base directory containing the bootstrap subdirectories and their
+                          cnv.txt files (created beforehand by make_bootstrap_dirs).
     """
     bootstrap_sub_dir = Path(output_dir) / f'bootstrap{bootstrap_iteration_num}'
-    os.makedirs(bootstrap_sub_dir, exist_ok=True)
     
     ssm_file_path = bootstrap_sub_dir / 'ssm.txt'
     
-    df_bootstrapped_ssm = pd.DataFrame(mutations_for_this_bootstrap_iter)
-    # Ensure correct SSM column order
-    if not df_bootstrapped_ssm.empty:
-        df_bootstrapped_ssm = df_bootstrapped_ssm[['id', 'gene', 'a', 'd', 'mu_r', 'mu_v']]
-    else: # Handle case of no valid mutations processed
-        df_bootstrapped_ssm = pd.DataFrame(columns=['id', 'gene', 'a', 'd', 'mu_r', 'mu_v'])
-
-    df_bootstrapped_ssm.to_csv(ssm_file_path, sep='\t', index=False)
-    
-    # Create empty CNV file (required by PhyloWGS)
-    cnv_file_path = bootstrap_sub_dir / 'cnv.txt'
-    cnv_file_path.touch()
+    # Write rows straight from the per-column arrays in SSM column order
+    write_ssm_file(ssm_file_path, {col: mutations_for_this_bootstrap_iter[col] for col in SSM_COLUMNS})
 
-def apply_vaf_prefiltering(input_ssm_df, threshold=0.9):
+def apply_vaf_prefiltering(input_ssm, read_counts, threshold=0.9):
     """
     Apply VAF pre-filtering using "any_high" strategy.
     Removes mutations where ANY sample has VAF >= threshold.
     
     Args:
-        input_ssm_df (pd.DataFrame): Input SSM DataFrame
+        input_ssm (dict): Input SSM table (column name -> np.ndarray)
+        read_counts (tuple): Parsed counts for input_ssm, as returned by parse_read_counts
         threshold (float): VAF threshold for filtering (default: 0.9)
         
     Returns:
-        pd.DataFrame: Filtered SSM DataFrame
+        tuple: (filtered_ssm, filtered_read_counts) - the filtered SSM table and the
+               matching rows of read_counts, so later stages need not re-parse
     """
     print(f"Applying VAF pre-filtering (threshold >= {threshold})...")
-    original_count = len(input_ssm_df)
-    
-    filtered_mutations = []
-    
-    for index, row in input_ssm_df.iterrows():
-        mutation_id_val = row['id']
-        
-        try:
-            # Parse reference and total counts
-            if isinstance(row['a'], str):
-                ref_counts_str = row['a'].split(',')
-                depth_counts_str = row['d'].split(',')
-            else:
-                ref_counts_str = [str(row['a'])]
-                depth_counts_str = [str(row['d'])]
-                
-            if len(ref_counts_str) != len(depth_counts_str):
-                print(f"Warning: Sample count mismatch for {mutation_id_val}, skipping")
-                continue
-                
-            ref_counts = [int(c) for c in ref_counts_str]
-            depth_counts = [int(d) for d in depth_counts_str]
-            
-        except (ValueError, AttributeError, TypeError):
-            print(f"Warning: Could not parse counts for {mutation_id_val}, skipping")
-            continue
-        
-        # Calculate VAFs for all samples
-        vafs = []
-        valid_sample_found = False
-        
-        for ref_count, total_depth in zip(ref_counts, depth_counts):
-            if total_depth < 0 or ref_count < 0 or ref_count > total_depth:
-                continue  # Skip invalid samples
-                
-            valid_sample_found = True
-            if total_depth == 0:
-                vafs.append(0.0)
-            else:
-                vaf = (total_depth - ref_count) / total_depth
-                vafs.append(vaf)
-        
-        if not valid_sample_found:
-            continue  # Skip mutations with no valid samples
-        
-        # Apply "any_high" filtering: keep if ALL VAFs < threshold
-        if all(vaf < threshold for vaf in vafs):
-            filtered_mutations.append(row)
-        else:
-            # Mutation filtered out due to high VAF
-            pass
+    original_count = num_mutations_in(input_ssm)
     
-    filtered_df = pd.DataFrame(filtered_mutations)
-    filtered_count = len(filtered_df)
+    ref_counts, depth_counts, valid_samples, mismatch, unparsed = read_counts
+
+    mutation_ids = input_ssm['id']
+    for mutation_id_val in mutation_ids[mismatch]:
+        print(f"Warning: Sample count mismatch for {mutation_id_val}, skipping")
+    for mutation_id_val in mutation_ids[unparsed & ~mismatch]:
+        print(f"Warning: Could not parse counts for {mutation_id_val}, skipping")
+
+    # Calculate VAFs for all samples; invalid samples are ignored
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vafs = np.where(depth_counts > 0, (depth_counts - ref_counts) / depth_counts, 0.0)
+
+    # Apply "any_high" filtering: keep if the highest valid-sample VAF < threshold,
+    # skipping mutations with no valid samples
+    max_vaf = np.max(np.where(valid_samples, vafs, -np.inf), axis=1, initial=-np.inf)
+    keep = (max_vaf < threshold) & valid_samples.any(axis=1) & ~(mismatch | unparsed)
+    filtered_count = int(keep.sum())
+
+    filtered_ssm = select_mutations(input_ssm, keep)
+    filtered_read_counts = tuple(counts[keep] for counts in read_counts)
     
     # Reassign sequential mutation IDs starting from s0 (required by PhyloWGS)
-    if not filtered_df.empty:
-        filtered_df.reset_index(drop=True, inplace=True)
-        filtered_df['id'] = [f's{i}' for i in range(len(filtered_df))]
-        print(f"Reassigned mutation IDs: s0 to s{len(filtered_df)-1}")
+    if filtered_count:
+        filtered_ssm['id'] = np.array([f's{i}' for i in range(filtered_count)], dtype=object)
+        print(f"Reassigned mutation IDs: s0 to s{filtered_count-1}")
     
     print(f"VAF pre-filtering: {original_count} → {filtered_count} mutations")
     print(f"Removed {original_count - filtered_count} mutations with VAF >= {threshold}")
     
-    return filtered_df
+    return filtered_ssm, filtered_read_counts
 
 
-def process_and_bootstrap_ssm(input_ssm_df, num_bootstraps, output_dir):
+def _bootstrap_chunk(vafs, depths, num_bootstraps, rng):
     """
-    Processes an input SSM DataFrame, performs bootstrapping, and writes output SSM files.
+    Bootstrap a block of mutations.
+
+    Args:
+        vafs (np.ndarray): VAFs (num_mutations, num_samples); invalid samples are 0.
+        depths (np.ndarray): Read depths (num_mutations, num_samples); invalid samples are 0.
+        num_bootstraps (int): Number of bootstrap samples to generate.
+        rng (np.random.Generator): Random stream for this block of mutations.
+
+    Returns:
+        tuple: (boot_vaf_array, boot_depth_array), each (num_mutations, num_samples, num_bootstraps)
+               VAFs are float32; depths are int16 when every mutation's total depth fits, else int32
     """
-    all_bootstrapped_iterations_data = [[] for _ in range(num_bootstraps)]
+    # Bootstrapped depths never exceed a mutation's total depth (plus one per sample from the
+    # zero-depth fix-up), so use the narrowest safe type
+    max_total_depth = depths.sum(axis=1).max() if len(depths) else 0
+    depth_dtype = np.int16 if max_total_depth + depths.shape[1] < np.iinfo(np.int16).max else np.int32
+    boot_vaf_array = np.zeros(depths.shape + (num_bootstraps,), dtype=np.float32)
+    boot_depth_array = np.zeros(depths.shape + (num_bootstraps,), dtype=depth_dtype)
+    # Invalid samples have depth 0 and are never assigned reads
+    _bootstrap_kernel(vafs, depths, num_bootstraps, boot_vaf_array, boot_depth_array, rng)
+    return boot_vaf_array, boot_depth_array
+
+
+def process_and_bootstrap_ssm(input_ssm, read_counts, num_bootstraps, output_dir, num_workers=1, seed=None):
+    """
+    Processes an input SSM table, performs bootstrapping, and writes output SSM files.
 
-    for index, row in input_ssm_df.iterrows():
-        mutation_id_val = row['id']
-        gene_val = row['gene']
-        mu_r_val = row['mu_r']
-        mu_v_val = row['mu_v']
+    read_counts holds the parsed 'a'/'d' matrices for input_ssm (see parse_read_counts).
 
+    Read counts are parsed into (num_mutations, num_samples) matrices up front and the
+    bootstrapped depths/VAFs for all mutations are collected into preallocated
+    (num_mutations, num_samples, num_bootstraps) arrays, so no per-iteration row dicts
+    are built. Chunks of mutations each draw from an independent random stream spawned
+    from seed and, with num_workers > 1, are bootstrapped in parallel worker processes.
+    Results are reproducible for a given seed regardless of num_workers.
+    """
+    ref_counts, depth_counts, valid_samples, mismatch, unparsed = read_counts
+
+    mutation_ids = input_ssm['id']
+    no_valid = ~valid_samples.any(axis=1)
+
+    for mutation_id_val in mutation_ids[mismatch]:
+        print(f"Warning: Mismatch in number of samples for 'a' and 'd' in mutation {mutation_id_val}. Skipping.")
+    for mutation_id_val in mutation_ids[unparsed & ~mismatch]:
+        print(f"Warning: Could not parse 'a' or 'd' columns for mutation {mutation_id_val}. Skipping.")
+    ok_rows = ~(mismatch | unparsed)
+    for m, s in zip(*np.nonzero(ok_rows[:, None] & ~np.isnan(ref_counts) & ~valid_samples)):
+        print(f"Warning: Invalid read counts (d={int(depth_counts[m, s])}, a={int(ref_counts[m, s])}) for a sample in mutation {mutation_ids[m]}. Skipping this sample for this mutation.")
+    for mutation_id_val in mutation_ids[ok_rows & no_valid]:
+        print(f"Warning: No valid samples found for mutation {mutation_id_val} after parsing/validation. Skipping this mutation.")
+
+    keep = ok_rows & ~no_valid
+    kept_rows = np.flatnonzero(keep)
+    valid_samples = valid_samples[keep]
+    depths = np.where(valid_samples, depth_counts[keep], 0).astype(np.int32)
+    refs = np.where(valid_samples, ref_counts[keep], 0).astype(np.int32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vafs = np.where(depths > 0, (depths - refs) / depths, 0.0)
+
+    # boot_vaf_array / boot_depth_array shape: (num_mutations, num_samples, num_bootstraps)
+    num_mutations = len(kept_rows)
+    # Mutations are always split into the same chunks, each with its own spawned stream, so
+    # the output for a given seed does not depend on num_workers
+    chunk_starts = range(0, max(num_mutations, 1), BOOTSTRAP_CHUNK_SIZE)
+    rngs = [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(len(chunk_starts))]
+    chunk_args = ([vafs[start:start + BOOTSTRAP_CHUNK_SIZE] for start in chunk_starts],
+                  [depths[start:start + BOOTSTRAP_CHUNK_SIZE] for start in chunk_starts],
+                  [num_bootstraps] * len(chunk_starts),
+                  rngs)
+    if num_workers > 1:
+        print(f"Bootstrapping {num_mutations} mutations in {len(chunk_starts)} chunks across {num_workers} workers...")
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            chunk_results = list(executor.map(_bootstrap_chunk, *chunk_args))
+    else:
+        chunk_results = list(map(_bootstrap_chunk, *chunk_args))
+    boot_vaf_array = np.concatenate([vaf for vaf, _ in chunk_results])
+    boot_depth_array = np.concatenate([depth for _, depth in chunk_results])
+
+    ids = input_ssm['id'][kept_rows]
+    genes = input_ssm['gene'][kept_rows]
+    mu_rs = input_ssm['mu_r'][kept_rows]
+    mu_vs = input_ssm['mu_v'][kept_rows]
+
+    # Calculate new variant and reference counts for all bootstraps at once
+    # np.rint is important here as counts must be integers
+    new_variant_counts = np.rint(boot_vaf_array * boot_depth_array).astype(boot_depth_array.dtype)
+    # Ensure ref_counts are not negative and also not greater than depth
+    new_ref_counts = np.clip(boot_depth_array - new_variant_counts, 0, boot_depth_array)
+
+    # Now write out each bootstrapped SSM file; writes run on a thread pool so file I/O
+    # overlaps with formatting the next iteration
+    print(f"Writing {num_bootstraps} bootstrapped SSM files to {output_dir}...")
+    make_bootstrap_dirs(output_dir, num_bootstraps)
+    with ThreadPoolExecutor(max_workers=BOOTSTRAP_WRITE_THREADS) as writer_pool:
+        write_futures = []
+        for k_bootstrap_iter in range(num_bootstraps):
+            write_futures.append(writer_pool.submit(write_bootstrapped_ssm_file, {
+                'id': ids,
+                'gene': genes,
+                'a': _join_counts(new_ref_counts[:, :, k_bootstrap_iter], valid_samples),
+                'd': _join_counts(boot_depth_array[:, :, k_bootstrap_iter], valid_samples),
+                'mu_r': mu_rs,
+                'mu_v': mu_vs
+            }, k_bootstrap_iter + 1, output_dir))
+
+        # Surface any write errors
+        for future in write_futures:
+            future.result()
+    print("Bootstrap processing complete.")
+
+
+def _load_cached_table(cache_path, cache_key):
+    """Load a pickled SSM table (or table and read counts), returning None if the cache is missing, unreadable or built for another key."""
+    try:
+        with open(cache_path, 'rb') as f:
+            key, ssm_table = pickle.load(f)
+    except Exception:
+        return None
+    if key != cache_key:
+        return None
+    print(f"Using cached data: {cache_path}")
+    return ssm_table
+
+
+def _save_cached_table(cache_path, cache_key, ssm_table):
+    """Atomically pickle an SSM table (or table and read counts) with its cache key; failures (e.g. a read-only directory) are ignored."""
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((cache_key, ssm_table), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
         try:
-            # Handle both single-sample (integers) and multi-sample (comma-separated strings) formats
-            if isinstance(row['a'], str):
-                # Multi-sample format: comma-separated string
-                ref_counts_str = row['a'].split(',')
-                depth_counts_str = row['d'].split(',')
-            else:
-                # Single-sample format: integer values
-                ref_counts_str = [str(row['a'])]
-                depth_counts_str = [str(row['d'])]
-
-            if len(ref_counts_str) != len(depth_counts_str):
-                print(f"Warning: Mismatch in number of samples for 'a' and 'd' in mutation {mutation_id_val}. Skipping.")
-                continue
-
-            ref_counts = [int(c) for c in ref_counts_str]
-            depth_counts = [int(d_val) for d_val in depth_counts_str] # Renamed d to d_val to avoid conflict
-        except ValueError:
-            print(f"Warning: Could not parse 'a' or 'd' columns for mutation {mutation_id_val}. Skipping.")
-            continue
-        except (AttributeError, TypeError): # Handles case where 'a' or 'd' might be unexpected types
-             print(f"Warning: 'a' or 'd' columns for mutation {mutation_id_val} have unexpected format. Skipping.")
-             continue
-
-
-        vaf_list_for_mutation = []
-        depth_list_for_mutation = []
-        valid_sample_found = False
-        for r, d_sample in zip(ref_counts, depth_counts): # Renamed d to d_sample
-            if d_sample < 0 or r < 0 or r > d_sample : # Basic sanity check
-                 print(f"Warning: Invalid read counts (d={d_sample}, a={r}) for a sample in mutation {mutation_id_val}. Skipping this sample for this mutation.")
-                 # We still need to append something to keep lists aligned for bootstrap_va_dt, or handle this inside.
-                 # For now, let's skip mutations with any invalid sample. A more robust way would be to skip only the sample.
-                 # However, bootstrap_va_dt expects aligned lists.
-                 # The current structure implies all samples for a mutation are processed together.
-                 # Let's append 0/0 for problematics samples but they might skew p_vals in multinomial
-                 # A better approach for now is to skip the entire mutation if any sample within it is bad.
-                 # To implement skipping only a sample, bootstrap_va_dt would need more complex input handling.
-                 continue # This skips the current sample, will be handled by checking valid_sample_found later
-
-            valid_sample_found = True # Mark that at least one sample is processable
-            if d_sample == 0:
-                vaf_list_for_mutation.append(0.0) # VAF is 0 if depth is 0
-            else:
-                vaf_list_for_mutation.append((d_sample - r) / d_sample)
-            depth_list_for_mutation.append(d_sample)
-        
-        if not valid_sample_found : # or if len(vaf_list_for_mutation) == 0:
-            print(f"Warning: No valid samples found for mutation {mutation_id_val} after parsing/validation. Skipping this mutation.")
-            continue
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
 
-        # boot_vaf_array: shape (num_samples, num_bootstraps)
-        # boot_depth_array: shape (num_samples, num_bootstraps)
-        # These arrays are for the current single mutation, across its samples and all bootstrap iterations
-        boot_vaf_array, boot_depth_array = bootstrap_va_dt(vaf_list_for_mutation, depth_list_for_mutation, num_bootstraps)
+def _cached_table(cache_path, cache_key, build):
+    """
+    Return build(), reusing the SSM table pickled at cache_path if it was built for cache_key.
+    """
+    ssm_table = _load_cached_table(cache_path, cache_key)
+    if ssm_table is None:
+        ssm_table = build()
+        _save_cached_table(cache_path, cache_key, ssm_table)
+    return ssm_table
 
-        for k_bootstrap_iter in range(num_bootstraps):
-            # Get VAFs and Depths for all samples of the current mutation for the k-th bootstrap
-            current_iter_vafs = boot_vaf_array[:, k_bootstrap_iter]
-            current_iter_depths = boot_depth_array[:, k_bootstrap_iter]
-
-            # Calculate new variant and reference counts
-            # np.round is important here as counts must be integers
-            new_variant_counts = np.round(current_iter_vafs * current_iter_depths).astype(int)
-            new_ref_counts = current_iter_depths - new_variant_counts
-            
-            # Ensure ref_counts are not negative (depths from bootstrap_va_dt should be >=0 after fix)
-            # and also not greater than depth
-            new_ref_counts = np.maximum(new_ref_counts, 0)
-            new_ref_counts = np.minimum(new_ref_counts, current_iter_depths)
-
-
-            bootstrapped_a_str = ",".join(map(str, new_ref_counts))
-            bootstrapped_d_str = ",".join(map(str, current_iter_depths))
-
-            all_bootstrapped_iterations_data[k_bootstrap_iter].append({
-                'id': mutation_id_val,
-                'gene': gene_val,
-                'a': bootstrapped_a_str,
-                'd': bootstrapped_d_str,
-                'mu_r': mu_r_val,
-                'mu_v': mu_v_val
-            })
-
-    # Now write out each bootstrapped SSM file
-    print(f"Writing {num_bootstraps} bootstrapped SSM files to {output_dir}...")
-    for i in range(num_bootstraps):
-        write_bootstrapped_ssm_file(all_bootstrapped_iterations_data[i], i + 1, output_dir)
-    print("Bootstrap processing complete.")
+
+def _file_digest(file_path):
+    """blake2b content hash of a file, used to key caches on input contents."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
 
 def main():
@@ -320,6 +459,11 @@ def main():
                        help='Output directory for bootstrapped SSM files. Subdirectories (bootstrap1, bootstrap2, etc.) will be created here.')
     parser.add_argument('-n', '--num_bootstraps', type=int, default=100,
                        help='Number of bootstrap iterations (default: 100)')
+    parser.add_argument('-j', '--num_workers', type=int,
+                       default=int(os.environ.get('SLURM_CPUS_PER_TASK', os.environ.get('BOOTSTRAP_CPUS', 1))),
+                       help='Number of worker processes for bootstrapping (default: SLURM_CPUS_PER_TASK, or 1)')
+    parser.add_argument('--seed', type=int, default=None,
+                       help='Random seed for reproducible bootstraps (default: fresh entropy)')
     args = parser.parse_args()
 
     # Ensure output directory exists
@@ -328,7 +472,10 @@ def main():
     # Read input SSM data
     print(f"Reading input SSM file: {args.input}")
     try:
-        input_ssm_df = pd.read_csv(args.input, sep='\t')
+        # Caches are keyed on the input file contents, so replaced inputs are never served stale
+        input_digest = _file_digest(args.input)
+        input_ssm = _cached_table(f"{args.input}.parsed.pkl", input_digest,
+                                  lambda: read_ssm_file(args.input))
     except FileNotFoundError:
         print(f"Error: Input SSM file not found at {args.input}")
         sys.exit(1)
@@ -336,28 +483,35 @@ def main():
         print(f"Error reading SSM file: {e}")
         sys.exit(1)
     
-    if input_ssm_df.empty:
+    if num_mutations_in(input_ssm) == 0:
         print("Input SSM file is empty. Exiting.")
         sys.exit(1)
 
     # Check for required columns
-    required_cols = ['id', 'gene', 'a', 'd', 'mu_r', 'mu_v']
-    missing_cols = [col for col in required_cols if col not in input_ssm_df.columns]
+    missing_cols = [col for col in SSM_COLUMNS if col not in input_ssm]
     if missing_cols:
         print(f"Error: Input SSM file is missing required columns: {', '.join(missing_cols)}")
         sys.exit(1)
 
-    # Apply VAF pre-filtering before bootstrap processing
-    filtered_ssm_df = apply_vaf_prefiltering(input_ssm_df, threshold=0.9)
+    # Apply VAF pre-filtering before bootstrap processing, memoized in the output directory
+    # on the input file contents and threshold
+    vaf_threshold = 0.9
+    filtered_cache_path = Path(args.output_dir) / f'.filtered_{input_digest}_{vaf_threshold}.pkl'
+    # Parse the 'a'/'d' columns once; the filtered read counts are cached alongside the table
+    # and handed on to bootstrapping
+    filtered_ssm, filtered_read_counts = _cached_table(
+        filtered_cache_path, (input_digest, vaf_threshold),
+        lambda: apply_vaf_prefiltering(input_ssm, parse_read_counts(input_ssm), threshold=vaf_threshold))
+    num_filtered = num_mutations_in(filtered_ssm)
     
-    if filtered_ssm_df.empty:
+    if num_filtered == 0:
         print("Error: All mutations were filtered out by VAF pre-filtering. Check input data quality.")
         sys.exit(1)
     
     # Check minimum mutation count for meaningful phylogenetic analysis
     min_mutations = 5
-    if len(filtered_ssm_df) < min_mutations:
-        print(f"Error: After VAF filtering, only {len(filtered_ssm_df)} mutations remain.")
+    if num_filtered < min_mutations:
+        print(f"Error: After VAF filtering, only {num_filtered} mutations remain.")
         print(f"Pipeline requires at least {min_mutations} mutations for meaningful phylogenetic analysis.")
         print("This typically indicates:")
         print("  - Input data has too many high-VAF mutations (likely artifacts)")
@@ -366,7 +520,7 @@ def main():
         print("Pipeline terminated to prevent poor-quality results.")
         sys.exit(1)
     
-    print(f"✅ Quality check passed: {len(filtered_ssm_df)} mutations available for phylogenetic analysis")
+    print(f"✅ Quality check passed: {num_filtered} mutations available for phylogenetic analysis")
     
     # Save filtered SSM file for downstream stages
     # Extract patient base directory from output path (output_dir is typically {patient_base}/initial/bootstraps)
@@ -380,10 +534,10 @@ def main():
         filtered_ssm_path = output_path / 'ssm_filtered.txt'
     
     print(f"Saving filtered SSM file to: {filtered_ssm_path}")
-    filtered_ssm_df.to_csv(filtered_ssm_path, sep='\t', index=False)
+    write_ssm_file(filtered_ssm_path, filtered_ssm)
     
     # Process bootstraps using filtered data
-    process_and_bootstrap_ssm(filtered_ssm_df, args.num_bootstraps, args.output_dir)
+    process_and_bootstrap_ssm(filtered_ssm, filtered_read_counts, args.num_bootstraps, args.output_dir, args.num_workers, args.seed)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
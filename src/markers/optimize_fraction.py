@@ -21,31 +21,30 @@ def create_sum_same_clone(tree_list, node_list, gene2idx, tree_freq_list=None):
     return sam_clo_matrix_sum
 
 
-def create_gene_fraction_array(tree, node_dict, clonal_freq, gene2idx, focus_sample_idx):
-    gene_fraction = np.zeros(len(gene2idx))
-    for node in tree:
-        if node in node_dict:
-            for gene in node_dict[node]:
-                idx = gene2idx[gene]
-                # changed from original clonal_freq[node][0][focus_sample_idx]
-                gene_fraction[idx] = clonal_freq[node][focus_sample_idx] 
-    return gene_fraction
-
-
-def create_concat_gene_fraction(tree_list, node_list, clonal_freq_list, gene2idx, tree_freq_list=None,focus_sample_idx=0):
+def create_tree_arrays(tree_list, node_list, clonal_freq_list, gene2idx, focus_sample_idx=0):
+    # array layout of the tree distribution: the node holding each gene in each tree
+    # (-1 if the gene is not placed) and each node's clonal frequency in the focus sample
     num_trees = len(tree_list)
     num_genes = len(gene2idx.keys())
-    if tree_freq_list is None:
-        tree_freq_list = np.ones(num_trees)
-    sum_tree_freq = np.sum(tree_freq_list)
-    gene_fraction_matrix = np.zeros((num_trees, num_genes))
+    num_nodes = max([int(node) for node_dict in node_list for node in node_dict] + [0]) + 1
+    gene_node_matrix = np.full((num_trees, num_genes), -1, dtype=int)
+    clonal_freq_matrix = np.zeros((num_trees, num_nodes))
     for i in range(num_trees):
         tree = tree_list[i]
         node_dict = node_list[i]
         clonal_freq = clonal_freq_list[i]
-        gene_fraction_array = create_gene_fraction_array(tree, node_dict, clonal_freq, gene2idx, focus_sample_idx)
-        gene_fraction_matrix[i] = gene_fraction_array
-    return gene_fraction_matrix
+        for node in tree:
+            if node in node_dict:
+                gene_node_matrix[i, [gene2idx[gene] for gene in node_dict[node]]] = int(node)
+                # changed from original clonal_freq[node][0][focus_sample_idx]
+                clonal_freq_matrix[i, int(node)] = clonal_freq[node][focus_sample_idx]
+    return gene_node_matrix, clonal_freq_matrix
+
+
+def create_concat_gene_fraction(tree_list, node_list, clonal_freq_list, gene2idx, tree_freq_list=None,focus_sample_idx=0):
+    gene_node_matrix, clonal_freq_matrix = create_tree_arrays(tree_list, node_list, clonal_freq_list, gene2idx, focus_sample_idx)
+    gene_fraction_matrix = np.take_along_axis(clonal_freq_matrix, np.maximum(gene_node_matrix, 0), axis=1)
+    return np.where(gene_node_matrix >= 0, gene_fraction_matrix, 0.0)
 
 
 def create_gene_variance_matrix(gene_fraction_matrix, read_depth=10000):
@@ -64,7 +63,7 @@ def create_concat_relation_matrix(tree_list, node_list, gene2idx, tree_freq_list
         relation_matrix_full[i, :, :] = create_ancestor_descendant_matrix(tree, node_dict, gene2idx)
     return relation_matrix_full
 
-def optimize_tree_distribution(F, R,  n_genes, n_markers, read_depth, lam1, lam2, tree_freq_list, subset_list=None):
+def optimize_tree_distribution(F, R,  n_genes, n_markers, read_depth, lam1, lam2, tree_freq_list, subset_list=None, start=None):
     model = gp.Model('opt_tree')
     V_sqr = create_gene_variance_matrix(F, read_depth)
     n_trees = F.shape[0]
@@ -98,6 +97,10 @@ def optimize_tree_distribution(F, R,  n_genes, n_markers, read_depth, lam1, lam2
         subset_constraints(model, z, subset_list, n_markers, n_genes)
     else:
         model.addConstr(gp.quicksum([z[i] for i in range(n_genes)]) == n_markers, name='n_marker constraint')
+    if start is not None:
+        # MIP start, e.g. the solution for one marker fewer extended by one marker
+        for i in range(n_genes):
+            z[i].Start = start[i]
     model.setObjective(gp.quicksum([lam1*Obj_frac, lam2*Obj_struct]), gp.GRB.MAXIMIZE)
     #model.setObjective(Obj_struct, gp.GRB.MAXIMIZE)
     model.optimize()
@@ -119,6 +122,119 @@ def select_markers_tree_gp(gene_list, n_markers, tree_list, node_list, clonal_fr
     return selected_markers, best_obj_frac, best_obj_struct
 
 
+def create_tree_objective_terms(F, R, read_depth, tree_freq_list):
+    # per-gene fraction score and pairwise structure score such that, for a 0/1 selection z,
+    # Obj_frac = frac_score @ z and Obj_struct = z @ pair_score @ z as in optimize_tree_distribution
+    V_sqr = create_gene_variance_matrix(F, read_depth)
+    n_trees = F.shape[0]
+    frac_diff_matrix = F[:, :, np.newaxis] - np.transpose(F)[np.newaxis, :]
+    var_sum_matrix = V_sqr[:, :, np.newaxis] + np.transpose(V_sqr)[np.newaxis, :]
+    ratio_matrix = frac_diff_matrix ** 2 / var_sum_matrix
+    log_likelihood_matrix = - 1 / 2 * read_depth ** 2 * ratio_matrix - 1 / 2 * np.log(var_sum_matrix)
+    for i in range(n_trees):
+        log_likelihood_matrix[i, :, i] = 0  # zero out the diagonal
+    frac_score = - np.sum(log_likelihood_matrix, axis=(0, 2))
+
+    tree_freq = np.asarray(tree_freq_list, dtype=float)
+    if np.all((R == 0) | (R == 1)):
+        # for 0/1 relations, sum_ik w_i w_k |R_i - R_k| = 2 W A - 2 A^2 with A = sum_i w_i R_i,
+        # which avoids materializing the pairwise tree differences
+        weighted_R = np.tensordot(tree_freq, R, axes=1)
+        pair_score = 2 * np.sum(tree_freq) * weighted_R - 2 * weighted_R ** 2
+    else:
+        pair_score = np.zeros(R.shape[1:])
+        for i in range(n_trees):
+            pair_score += tree_freq[i] * np.tensordot(tree_freq, np.abs(R[i] - R), axes=1)
+    return frac_score, pair_score * np.log(10)
+
+
+def greedy_select_markers(gene_list, max_markers, frac_score, pair_score, lam1, lam2, subset_list=None):
+    # greedy forward selection: one pass returns the markers in selection order together with
+    # (obj_frac, obj_struct) of the first k markers for every k, instead of one solve per k.
+    # This is exact for lam2=0 (the objective is linear); with structure weighted it is only a
+    # heuristic, see select_markers_tree_struct_incremental for the exact per-k solve
+    n_genes = len(gene_list)
+    candidates = np.zeros(n_genes, dtype=bool)
+    candidates[list(range(n_genes)) if subset_list is None else subset_list] = True
+    n_select = min(max_markers, int(candidates.sum()))
+    struct_gain = np.diag(pair_score).copy()
+
+    # a single marker has no pairwise structure, so when structure is weighted the first
+    # two markers are seeded with the best pair rather than an arbitrary zero-gain marker
+    seed = []
+    if lam2 != 0 and n_select >= 2:
+        pair_gain = lam1 * (frac_score[:, np.newaxis] + frac_score[np.newaxis, :]) + \
+            lam2 * (pair_score + pair_score.T + struct_gain[:, np.newaxis] + struct_gain[np.newaxis, :])
+        valid_pair = candidates[:, np.newaxis] & candidates[np.newaxis, :] & ~np.eye(n_genes, dtype=bool)
+        a, b = np.unravel_index(np.argmax(np.where(valid_pair, pair_gain, -np.inf)), pair_gain.shape)
+        single_gain = lam1 * frac_score + lam2 * struct_gain
+        if (single_gain[b], frac_score[b]) > (single_gain[a], frac_score[a]):
+            a, b = b, a
+        seed = [int(a), int(b)]
+
+    obj_frac, obj_struct = 0.0, 0.0
+    ordered_markers, objectives = [], []
+    for step in range(n_select):
+        if step < len(seed):
+            best = seed[step]
+        else:
+            gain = np.where(candidates, lam1 * frac_score + lam2 * struct_gain, -np.inf)
+            # ties (e.g. equal structure gains) go to the marker with the larger fraction score
+            tied = np.flatnonzero(gain == np.max(gain))
+            best = int(tied[np.argmax(frac_score[tied])]) if tied.size else int(np.argmax(gain))
+        obj_frac += frac_score[best]
+        obj_struct += struct_gain[best]
+        candidates[best] = False
+        struct_gain += pair_score[best, :] + pair_score[:, best]
+        ordered_markers.append(gene_list[best])
+        objectives.append((obj_frac, obj_struct))
+    return ordered_markers, objectives
+
+
+def select_markers_tree_struct_incremental(gene_list, max_markers, F, R, read_depth, pair_score, tree_freq_list,
+                                          lam1=0, lam2=1, subset_list=None):
+    # exact optimize_tree_distribution solve for every k = 1..max_markers. Each solve is warm
+    # started with the optimum for k-1 extended by the candidate with the largest structure gain,
+    # and the new marker at step k is the first selected marker not already in the ordering
+    n_genes = len(gene_list)
+    candidates = np.zeros(n_genes, dtype=bool)
+    candidates[list(range(n_genes)) if subset_list is None else subset_list] = True
+    n_select = min(max_markers, int(candidates.sum()))
+    prev_z = np.zeros(n_genes)
+    seen = set()
+    ordered_markers, objectives = [], []
+    for n_markers in range(1, n_select + 1):
+        struct_gain = np.diag(pair_score) + pair_score @ prev_z + prev_z @ pair_score
+        start = prev_z.copy()
+        start[int(np.argmax(np.where(candidates & (prev_z == 0), struct_gain, -np.inf)))] = 1
+        obj_frac, obj_struct, z = optimize_tree_distribution(F, R, n_genes, n_markers, read_depth, lam1, lam2,
+                                                             tree_freq_list, subset_list, start=start)
+        prev_z = np.round(z)
+        selected = np.flatnonzero(prev_z == 1)
+        new_markers = [idx for idx in selected if idx not in seen]
+        if not new_markers:
+            print(f"Warning: No new markers found for n_markers={n_markers} (lam1={lam1}, lam2={lam2}). This may indicate optimization issues.")
+            break
+        seen.add(new_markers[0])
+        ordered_markers.append(gene_list[new_markers[0]])
+        objectives.append((obj_frac, obj_struct))
+    return ordered_markers, objectives
+
+
+def select_markers_tree_gp_both(gene_list, max_markers, tree_list, node_list, clonal_freq_list, gene2idx, tree_freq_list,
+                                read_depth=10000, focus_sample_idx=0, subset_list=None):
+    # pure fraction (lam1=1, lam2=0) and pure structure (lam1=0, lam2=1) selections sharing one
+    # construction of F, R and the objective terms. The fraction objective is linear, so its
+    # greedy ordering is exact; the structure pass keeps the exact Gurobi solve per k
+    F = create_concat_gene_fraction(tree_list, node_list, clonal_freq_list, gene2idx, tree_freq_list, focus_sample_idx)
+    R = create_concat_relation_matrix(tree_list, node_list, gene2idx)
+    frac_score, pair_score = create_tree_objective_terms(F, R, read_depth, tree_freq_list)
+    markers_frac, objectives_frac = greedy_select_markers(gene_list, max_markers, frac_score, pair_score, 1, 0, subset_list)
+    markers_struct, objectives_struct = select_markers_tree_struct_incremental(
+        gene_list, max_markers, F, R, read_depth, pair_score, tree_freq_list, 0, 1, subset_list)
+    return markers_frac, markers_struct, objectives_frac, objectives_struct
+
+
 def optimize_fraction_weighted_single(E, M, F_hat, n_genes, n_markers):
     print(E, M, F_hat)
     k = E.shape[0]
@@ -36,6 +36,15 @@ def parse_gene_info(gene_string):
     else:  # Other unexpected formats or too few parts after split (e.g. "SYMBOL_")
         return {'Symbol': gene_string, 'Chromosome': 'N/A', 'Start_Position': 'N/A'}
 
+def next_new_marker(selected_markers_genename, seen):
+    """Return the first selected marker not already in seen (adding it), or the first marker if none is new."""
+    for marker in selected_markers_genename:
+        if marker not in seen:
+            seen.add(marker)
+            return marker
+    print(f"Warning: No new markers found among {len(selected_markers_genename)} selected markers.")
+    return selected_markers_genename[0]
+
 def parse_args():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(description='Run marker selection analysis.')
@@ -188,12 +197,11 @@ def main():
     # Construct gene_name_list from ssm_df ('gene' column), ensuring uniqueness
     # The 'gene' column in ssm.txt is expected to be in SYMBOL_CHR_POS_REF>ALT format
     # or just SYMBOL. The existing logic handles creating unique names if needed.
-    for i in range(calls.shape[0]):
+    for gene_base_name, mutation_id in zip(calls["gene"].tolist(), calls["id"].tolist()):
         # The 'gene' column from ssm.txt is used directly here.
         # It might be just a SYMBOL or a more complex string like SYMBOL_CHR_POS_REF>ALT.
         # The original script had logic to parse Symbol, Ref, Alt from different columns
-        # to form a base name. Here, we assume `calls.iloc[i]["gene"]` is the intended base name.
-        gene_base_name = calls.iloc[i]["gene"] 
+        # to form a base name. Here, we assume the "gene" value is the intended base name.
 
         if pd.isna(gene_base_name) or not isinstance(gene_base_name, str):
             # Fallback if 'gene' column is problematic or missing, though ssm.txt should have it.
@@ -217,7 +225,7 @@ def main():
             # This part of the original code is less likely to be hit if ssm.txt is well-formed,
             # but kept for robustness. The original used Chrom/Pos/Ref/Alt for this.
             # Since we don't have those parsed yet, we'll use the 'id' as a fallback name for uniqueness.
-            gene_unique_name_candidate = str(calls.iloc[i]["id"]) # Fallback to ssm_df 'id'
+            gene_unique_name_candidate = str(mutation_id) # Fallback to ssm_df 'id'
         else:
             gene_unique_name_candidate = gene_base_name # This is typically SYMBOL_CHR_POS_REF>ALT
 
@@ -233,19 +241,10 @@ def main():
     tree_list, node_list, clonal_freq_list, tree_freq_list = tree_distribution['tree_structure'], tree_distribution['node_dict'],tree_distribution['vaf_frac'],tree_distribution['freq']
 
     #scrub node_list
-    node_list_scrub = []
-    for node_dict in node_list:
-        temp = {}
-        for key, values in node_dict.items():
-            temp.setdefault(int(key), values)
-        node_list_scrub.append(temp)
-
-    clonal_freq_list_scrub = []
-    for clonal_freq_dict in clonal_freq_list:
-        temp = {}
-        for key, values in clonal_freq_dict.items():
-            temp.setdefault(int(key), values[0])
-        clonal_freq_list_scrub.append(temp)
+    node_list_scrub = [{int(key): values for key, values in node_dict.items()} for node_dict in node_list]
+
+    clonal_freq_list_scrub = [{int(key): values[0] for key, values in clonal_freq_dict.items()}
+                              for clonal_freq_dict in clonal_freq_list]
 
     # Run marker selection with different methods and parameters
     # Save marker selection results to a text file
@@ -257,16 +256,13 @@ def main():
     # Method 1: Tracing fractions
     selected_markers1_genename_ordered = []
     obj1_ordered = []
+    seen1 = set()
 
     for n_markers in range(1, len(gene_name_list) + 1):
         selected_markers1, obj = select_markers_fractions_weighted_overall(gene_list, n_markers, tree_list, node_list_scrub, clonal_freq_list_scrub, gene2idx, tree_freq_list)
-        selected_markers1_genename = [gene_name_list[int(i[1:])] for i in selected_markers1]
+        selected_markers1_genename = [gene_name_list[gene2idx[i]] for i in selected_markers1]
         obj1_ordered.append(obj)
-        if len(selected_markers1_genename) == 1:
-            selected_markers1_genename_ordered.append(selected_markers1_genename[0])
-        else:
-            diff_set = set(selected_markers1_genename).difference(set(selected_markers1_genename_ordered))
-            selected_markers1_genename_ordered.append(list(diff_set)[0])
+        selected_markers1_genename_ordered.append(next_new_marker(selected_markers1_genename, seen1))
     
     # Save Method 1 results
     with open(results_file, 'a') as f:
@@ -293,19 +289,16 @@ def main():
     for lam1, lam2 in [(1, 0), (0, 1)]:
         selected_markers2_genename_ordered = []
         obj2_ordered = []
+        seen2 = set()
         
         for n_markers in range(1, len(gene_name_list) + 1):
             selected_markers2, obj_frac, obj_struct = select_markers_tree_gp(
                 gene_list, n_markers, tree_list, node_list_scrub, clonal_freq_list_scrub, 
                 gene2idx, tree_freq_list, read_depth=read_depth, lam1=lam1, lam2=lam2
             )
-            selected_markers2_genename = [gene_name_list[int(i[1:])] for i in selected_markers2]
+            selected_markers2_genename = [gene_name_list[gene2idx[i]] for i in selected_markers2]
             obj2_ordered.append((obj_frac, obj_struct))
-            if len(selected_markers2_genename) == 1:
-                selected_markers2_genename_ordered.append(selected_markers2_genename[0])
-            else:
-                selected_markers2_genename_ordered.append(
-                    list(set(selected_markers2_genename).difference(set(selected_markers2_genename_ordered)))[0])
+            selected_markers2_genename_ordered.append(next_new_marker(selected_markers2_genename, seen2))
 
         # Save Method 2 results
         with open(results_file, 'a') as f:
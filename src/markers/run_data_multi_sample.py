@@ -6,16 +6,39 @@ This script works with the new multi-sample DataFrame format while maintaining
 compatibility with the original marker selection algorithms and tree distribution data.
 """
 
-from optimize import *
-from optimize_fraction import select_markers_tree_gp
+import matplotlib
+matplotlib.use('Agg')  # headless backend for batch jobs; must be selected before pyplot is imported
+# Keep the small line plots on the fast rendering path regardless of any site/user matplotlibrc
+matplotlib.rcParams.update({
+    'text.usetex': False,
+    'axes.formatter.use_mathtext': False,
+    'path.simplify': True,
+    'path.simplify_threshold': 1.0,
+    'agg.path.chunksize': 10000,
+})
+from optimize_fraction import select_markers_tree_gp_both
 # Note: VAF filtering now handled in bootstrap stage, no need for convert_ssm
+import numpy as np
 import pandas as pd
 import pickle
 import argparse
+import hashlib
 import matplotlib.pyplot as plt
 import os
 import sys
 
+# (lam1, lam2) weightings of the fraction and structure objectives, in select_markers_tree_gp_both's output order
+LAMBDA_SETTINGS = [(1, 0), (0, 1)]
+
+# SSM columns used for marker selection, read as plain strings (counts are comma-separated per sample)
+SSM_DTYPES = {'gene': str, 'a': str, 'd': str}
+
+# Rows per block when streaming the SSM file
+SSM_CHUNK_SIZE = 100_000
+
+# Read buffer for the (potentially large) tree distribution pickle
+PICKLE_READ_BUFFER = 1 << 20
+
 
 def parse_args():
     """Parse command line arguments."""
@@ -36,12 +59,112 @@ def parse_args():
     parser.add_argument('-o', '--output-dir', type=str,
                         help='Path to output directory for marker selection results')
     
+    parser.add_argument('--force', action='store_true',
+                        help='Rerun even if results for identical inputs already exist in the output directory')
+    
     # Note: VAF filtering is now handled in the bootstrap stage
     # The SSM file passed to this script should already be pre-filtered
     
     return parser.parse_args()
 
 
+def parse_gene_info(genes):
+    """
+    Parse gene strings (expected format: SYMBOL_CHR_POS_REF>ALT or just SYMBOL) for all mutations.
+
+    Strings with fewer than four '_'-separated parts are kept whole as the symbol; missing
+    genes become 'Unknown'. Uses vectorized pandas string operations rather than a per-row parse.
+
+    Returns:
+        pd.DataFrame: Columns 'Symbol', 'Chromosome', 'Start_Position', 'Ref', 'Alt'
+    """
+    missing = genes.isna().to_numpy()
+    gene_strs = genes.astype(str)
+    parts = gene_strs.str.split('_', expand=True).reindex(columns=range(4))
+    has4 = parts[3].notna().to_numpy() & ~missing
+
+    mutation = parts[3].where(has4, '').str.split('>', n=1, expand=True).reindex(columns=range(2))
+    has_alt = mutation[1].notna().to_numpy()
+
+    return pd.DataFrame({
+        'Symbol': np.where(has4, parts[0], np.where(missing, 'Unknown', gene_strs)),
+        'Chromosome': np.where(has4, parts[1], 'N/A'),
+        'Start_Position': np.where(has4, parts[2], 'N/A'),
+        'Ref': np.where(has_alt, mutation[0], 'N'),
+        'Alt': np.where(has_alt, mutation[1], 'N'),
+    }, index=genes.index)
+
+
+def _split_counts(count_column):
+    """Split comma-separated read counts into a float matrix (NaN where absent) plus a parse-failure mask."""
+    tokens = count_column.astype(str).str.split(',', expand=True)
+    tokens = tokens.apply(lambda col: col.str.strip())
+    counts = tokens.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    present = (tokens.notna() & tokens.ne('')).to_numpy()
+    # Counts must be integers, as int() would require; tokens like 1.5 or inf are failures
+    integral = tokens.apply(lambda col: col.str.fullmatch(r'[+-]?\d+')).fillna(False).to_numpy(dtype=bool)
+    failed = (present & ~integral).any(axis=1)
+    return counts, failed
+
+
+def calculate_sample_vafs(ssm_df):
+    """
+    Calculate per-sample VAFs, (d - a) / d, from the 'a' and 'd' columns for all mutations.
+
+    Rows whose counts cannot be parsed get VAF 0.0 in every sample, as do samples with zero
+    depth. The result always has at least two columns (padded with 0.0) for the cf/st samples.
+
+    Returns:
+        np.ndarray: VAF matrix of shape (num_mutations, max(num_samples, 2))
+    """
+    a_counts, a_failed = _split_counts(ssm_df['a'])
+    d_counts, d_failed = _split_counts(ssm_df['d'])
+
+    num_samples = min(a_counts.shape[1], d_counts.shape[1])
+    a_counts = a_counts[:, :num_samples]
+    d_counts = d_counts[:, :num_samples]
+
+    valid = (d_counts > 0) & ~np.isnan(a_counts)
+    safe_depth = np.where(valid, d_counts, 1.0)
+    vafs = np.where(valid, (d_counts - a_counts) / safe_depth, 0.0)
+    vafs[a_failed | d_failed] = 0.0
+
+    if num_samples < 2:
+        vafs = np.pad(vafs, ((0, 0), (0, 2 - num_samples)))
+    return vafs
+
+
+def build_inter(ssm_df):
+    """
+    Build the backward-compatible marker selection table for a block of SSM rows.
+
+    Returns:
+        pd.DataFrame: Gene fields from parse_gene_info plus the first two samples' VAFs
+    """
+    gene_info_list = parse_gene_info(ssm_df['gene'])
+    vaf_matrix = calculate_sample_vafs(ssm_df)
+    return pd.DataFrame({
+        'Hugo_Symbol': gene_info_list['Symbol'].to_numpy(),
+        'Reference_Allele': gene_info_list['Ref'].to_numpy(),
+        'Allele': gene_info_list['Alt'].to_numpy(),
+        'Chromosome': gene_info_list['Chromosome'].to_numpy(),
+        'Start_Position': gene_info_list['Start_Position'].to_numpy(),
+        'Variant_Frequencies_cf': vaf_matrix[:, 0],
+        'Variant_Frequencies_st': vaf_matrix[:, 1]
+    })
+
+
+def inputs_fingerprint(file_paths, *params):
+    """blake2b hash of the input files' contents and the run parameters, used to detect finished runs."""
+    digest = hashlib.blake2b(digest_size=16)
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
+
 # Obsolete functions removed - VAF filtering now handled in bootstrap stage
 # create_backward_compatible_dataframe() - No longer needed
 # validate_tree_compatibility() - Tree compatibility guaranteed by design
@@ -71,100 +194,62 @@ def main():
         print(f"Error: SSM file not found at {ssm_file_path}")
         sys.exit(1)
 
+    # Skip the run only if the last completed run used identical inputs and its outputs are still present
+    done_marker = os.path.join(output_dir, '.done')
+    fingerprint = inputs_fingerprint([ssm_file_path, tree_distribution_file], patient, read_depth)
+    results_file = os.path.join(output_dir, f'{patient}_marker_selection_results.txt')
+    plot_files = [os.path.join(output_dir, f'{patient}_trees_{kind}_{lam1}_{lam2}_{read_depth}.png')
+                  for lam1, lam2 in LAMBDA_SETTINGS for kind in ('fractions', 'structures')]
+    if not args.force and os.path.exists(done_marker):
+        with open(done_marker) as f:
+            previous_fingerprint = f.read().strip()
+        if previous_fingerprint == fingerprint and all(os.path.exists(path) for path in [results_file] + plot_files):
+            print(f"Results for identical inputs already exist in {output_dir} (cached), skipping. Use --force to rerun.")
+            return
+    # Invalidate the marker until this run completes
+    if os.path.exists(done_marker):
+        os.remove(done_marker)
+
     # Load tree distribution from aggregation directory
     print("Loading tree distribution data...")
-    with open(tree_distribution_file, 'rb') as f:
+    with open(tree_distribution_file, 'rb', buffering=PICKLE_READ_BUFFER) as f:
         tree_distribution = pickle.load(f)
 
-    # Read pre-filtered SSM file directly (filtering done in bootstrap stage)
+    # Read pre-filtered SSM file directly (filtering done in bootstrap stage), in chunks so
+    # only the compact marker-selection table is ever held for the whole file
     print(f"Reading pre-filtered SSM file: {ssm_file_path}")
+    inter_parts = []
+    gene_name_list = []
     try:
-        ssm_df = pd.read_csv(ssm_file_path, sep='\t')
+        for ssm_chunk in pd.read_csv(ssm_file_path, sep='\t', usecols=list(SSM_DTYPES), dtype=SSM_DTYPES,
+                                     chunksize=SSM_CHUNK_SIZE):
+            inter_parts.append(build_inter(ssm_chunk))
+            # Use original SSM gene identifiers directly (already informative)
+            gene_name_list.extend(ssm_chunk['gene'].tolist())
     except Exception as e:
         print(f"Error reading SSM file: {e}")
         sys.exit(1)
     
-    print(f"Pre-filtered SSM DataFrame shape: {ssm_df.shape}")
+    print(f"Pre-filtered SSM mutations: {len(gene_name_list)}")
     
-    if ssm_df.empty:
+    if not gene_name_list:
         print("Error: SSM file is empty.")
         sys.exit(1)
     
-    # Parse gene information from SSM file for backward compatibility
-    def parse_gene_info(gene_string):
-        """Parse gene string (expected format: SYMBOL_CHR_POS_REF>ALT or just SYMBOL)"""
-        if pd.isna(gene_string) or not isinstance(gene_string, str):
-            return {'Symbol': 'Unknown', 'Chromosome': 'N/A', 'Start_Position': 'N/A', 'Ref': 'N', 'Alt': 'N'}
-        
-        parts = gene_string.split('_')
-        if len(parts) >= 4:
-            symbol = parts[0]
-            chromosome = parts[1] 
-            position = parts[2]
-            mutation_part = parts[3]
-            if '>' in mutation_part:
-                ref, alt = mutation_part.split('>', 1)
-            else:
-                ref, alt = 'N', 'N'
-            return {'Symbol': symbol, 'Chromosome': chromosome, 'Start_Position': position, 'Ref': ref, 'Alt': alt}
-        else:
-            return {'Symbol': gene_string, 'Chromosome': 'N/A', 'Start_Position': 'N/A', 'Ref': 'N', 'Alt': 'N'}
-    
-    # Create backward-compatible DataFrame structure
-    gene_info_list = ssm_df['gene'].apply(parse_gene_info)
-    
-    # Calculate VAFs from 'a' and 'd' columns for first two samples (backward compatibility)
-    def calculate_sample_vafs(row):
-        try:
-            a_counts = [int(x) for x in str(row['a']).split(',') if x.strip()]
-            d_counts = [int(x) for x in str(row['d']).split(',') if x.strip()]
-            
-            vafs = []
-            for ref_count, total_depth in zip(a_counts, d_counts):
-                if total_depth > 0:
-                    vaf = (total_depth - ref_count) / total_depth
-                    vafs.append(vaf)
-                else:
-                    vafs.append(0.0)
-            return vafs
-        except:
-            return [0.0, 0.0]
-    
-    vaf_lists = ssm_df.apply(calculate_sample_vafs, axis=1)
-    
-    # Create DataFrame with marker selection expected format
-    inter_data = []
-    for i, (idx, row) in enumerate(ssm_df.iterrows()):
-        gene_info = gene_info_list.iloc[i]
-        vafs = vaf_lists.iloc[i]
-        
-        inter_data.append({
-            'Hugo_Symbol': gene_info['Symbol'],
-            'Reference_Allele': gene_info['Ref'],
-            'Allele': gene_info['Alt'],
-            'Chromosome': gene_info['Chromosome'],
-            'Start_Position': gene_info['Start_Position'],
-            'Variant_Frequencies_cf': vafs[0] if len(vafs) > 0 else 0.0,
-            'Variant_Frequencies_st': vafs[1] if len(vafs) > 1 else 0.0
-        })
-    
-    inter = pd.DataFrame(inter_data)
+    inter = pd.concat(inter_parts, ignore_index=True)
     print(f"Created backward-compatible DataFrame with {len(inter)} mutations")
     
     calls = inter
 
     # Create gene indexing exactly as in old code
-    gene2idx = {'s' + str(i): i for i in range(len(inter))}
-    gene_list = list(gene2idx.keys())
+    gene_list = [f's{i}' for i in range(len(inter))]
+    gene2idx = dict(zip(gene_list, range(len(gene_list))))
     
     print(f"Created gene indexing: {len(gene_list)} genes (s0 to s{len(gene_list)-1})")
 
     # Tree compatibility is guaranteed since bootstrap, PhyloWGS, and marker selection
     # all use the same pre-filtered mutation set from the bootstrap stage
 
-    # Use original SSM gene identifiers directly (already informative)
-    gene_name_list = ssm_df['gene'].tolist()
-
     print(f"Created gene names: {len(gene_name_list)} entries")
     print("Sample gene names:", gene_name_list[:5])
 
@@ -176,106 +261,93 @@ def main():
         tree_distribution['freq']
     )
 
-    # Scrub node_list (same as old code)
-    node_list_scrub = []
-    for node_dict in node_list:
-        temp = {}
-        for key, values in node_dict.items():
-            temp.setdefault(int(key), values)
-        node_list_scrub.append(temp)
-
-    clonal_freq_list_scrub = []
-    for clonal_freq_dict in clonal_freq_list:
-        temp = {}
-        for key, values in clonal_freq_dict.items():
-            temp.setdefault(int(key), values[0])
-        clonal_freq_list_scrub.append(temp)
+    # Scrub node_list (same as old code): integer node keys, first clonal frequency entry
+    node_list_scrub = [{int(key): values for key, values in node_dict.items()} for node_dict in node_list]
+    clonal_freq_list_scrub = [{int(key): values[0] for key, values in clonal_freq_dict.items()}
+                              for clonal_freq_dict in clonal_freq_list]
 
     print(f"Tree distribution loaded: {len(tree_list)} trees, {len(node_list)} node sets")
 
     # Save marker selection results to a text file
-    results_file = os.path.join(output_dir, f'{patient}_marker_selection_results.txt')
+    header_lines = [
+        f"Marker Selection Results for Patient {patient}",
+        "=" * 50,
+        f"Input (pre-filtered): {ssm_file_path}",
+        f"Mutations in analysis: {len(gene_list)}",
+        f"Read depth: {read_depth}",
+    ]
     with open(results_file, 'w') as f:
-        f.write(f"Marker Selection Results for Patient {patient}\n")
-        f.write("=" * 50 + "\n")
-        f.write(f"Input (pre-filtered): {ssm_file_path}\n")
-        f.write(f"Mutations in analysis: {len(gene_list)}\n")
-        f.write(f"Read depth: {read_depth}\n\n")
+        f.write("\n".join(header_lines) + "\n\n")
 
     # Tree-based marker selection using two optimization strategies
 
-    # Tree-based selection with two optimization strategies
-    for lam1, lam2 in [(1, 0), (0, 1)]:
-        print(f"Running Method 2: Tree-based selection (lam1={lam1}, lam2={lam2})...")
+    # Tree-based selection with two optimization strategies, sharing one setup of the tree objectives
+    print("Running tree-based selection for pure fraction and pure structure optimization...")
+    markers_frac, markers_struct, objectives_frac, objectives_struct = select_markers_tree_gp_both(
+        gene_list, len(gene_name_list), tree_list, node_list_scrub, clonal_freq_list_scrub,
+        gene2idx, tree_freq_list, read_depth=read_depth
+    )
+    selections = [(markers_frac, objectives_frac), (markers_struct, objectives_struct)]
+
+    # One figure is reused for every plot
+    fig, ax = plt.subplots(figsize=(8, 5))
+
+    for (lam1, lam2), (ordered_markers, objectives) in zip(LAMBDA_SETTINGS, selections):
+        print(f"Method 2: Tree-based selection (lam1={lam1}, lam2={lam2})...")
         selected_markers2_genename_ordered = []
         obj2_ordered = []
         
-        for n_markers in range(1, len(gene_name_list) + 1):
-            selected_markers2, obj_frac, obj_struct = select_markers_tree_gp(
-                gene_list, n_markers, tree_list, node_list_scrub, clonal_freq_list_scrub, 
-                gene2idx, tree_freq_list, read_depth=read_depth, lam1=lam1, lam2=lam2
-            )
-            
-            # Handle case where optimization failed and returned empty results
-            if not selected_markers2 or any(pd.isna([obj_frac, obj_struct])):
+        for n_markers, (marker, (obj_frac, obj_struct)) in enumerate(zip(ordered_markers, objectives), 1):
+            # Stop at the first selection step whose objectives could not be evaluated
+            if any(pd.isna([obj_frac, obj_struct])):
                 print(f"Warning: Tree optimization failed for n_markers={n_markers} (lam1={lam1}, lam2={lam2}). Skipping this iteration.")
-                print(f"Selected markers: {selected_markers2}, Objectives: frac={obj_frac}, struct={obj_struct}")
+                print(f"Selected marker: {marker}, Objectives: frac={obj_frac}, struct={obj_struct}")
                 break
-                
-            selected_markers2_genename = [gene_name_list[int(i[1:])] for i in selected_markers2]
-            obj2_ordered.append((obj_frac, obj_struct))
             
-            if len(selected_markers2_genename) == 1:
-                selected_markers2_genename_ordered.append(selected_markers2_genename[0])
-            else:
-                diff_set = set(selected_markers2_genename).difference(set(selected_markers2_genename_ordered))
-                if diff_set:  # Check if diff_set is not empty
-                    selected_markers2_genename_ordered.append(list(diff_set)[0])
-                else:
-                    print(f"Warning: No new markers found for n_markers={n_markers} (lam1={lam1}, lam2={lam2}). This may indicate optimization issues.")
-                    # Use the first marker from selected_markers2_genename as fallback
-                    if selected_markers2_genename:
-                        selected_markers2_genename_ordered.append(selected_markers2_genename[0])
-                    else:
-                        print(f"Error: No markers selected for n_markers={n_markers} (lam1={lam1}, lam2={lam2}). Breaking loop.")
-                        break
+            selected_markers2_genename_ordered.append(gene_name_list[gene2idx[marker]])
+            obj2_ordered.append((obj_frac, obj_struct))
 
         # Save Method 2 results with descriptive headers
+        if lam1 == 1 and lam2 == 0:
+            section_title = "λ1=1, λ2=0 (Pure Fraction Optimization):"
+        elif lam1 == 0 and lam2 == 1:
+            section_title = "λ1=0, λ2=1 (Pure Structure Optimization):"
+        else:
+            section_title = f"λ1={lam1}, λ2={lam2} (Mixed Optimization):"
+        section_lines = ["", section_title, "-" * 40]
+        section_lines += [f"{i}. {marker}: fraction={obj_frac}, structure={obj_struct}"
+                          for i, (marker, (obj_frac, obj_struct)) in enumerate(zip(selected_markers2_genename_ordered, obj2_ordered), 1)]
         with open(results_file, 'a') as f:
-            if lam1 == 1 and lam2 == 0:
-                f.write(f"\nλ1=1, λ2=0 (Pure Fraction Optimization):\n")
-            elif lam1 == 0 and lam2 == 1:
-                f.write(f"\nλ1=0, λ2=1 (Pure Structure Optimization):\n")
-            else:
-                f.write(f"\nλ1={lam1}, λ2={lam2} (Mixed Optimization):\n")
-            f.write("-" * 40 + "\n")
-            for i, (marker, (obj_frac, obj_struct)) in enumerate(zip(selected_markers2_genename_ordered, obj2_ordered), 1):
-                f.write(f"{i}. {marker}: fraction={obj_frac}, structure={obj_struct}\n")
-            f.write("\n")
-
-        obj2_frac_ordered = [obj2_ordered[i][0] for i in range(len(obj2_ordered))]
-        obj2_struct_ordered = [obj2_ordered[i][1] for i in range(len(obj2_ordered))]
+            f.write("\n".join(section_lines) + "\n\n")
+
+        obj2_frac_ordered, obj2_struct_ordered = (list(objs) for objs in zip(*obj2_ordered)) if obj2_ordered else ([], [])
         position2 = list(range(len(obj2_ordered)))
 
         # Plot fractions
-        plt.figure(figsize=(8, 5))
-        plt.plot(position2, obj2_frac_ordered, 'o-', color='tab:orange', label='trees-fractions')
-        plt.xticks(position2, selected_markers2_genename_ordered, rotation=30)
-        plt.legend()
-        plt.title(f'Patient {patient} - Tree Fractions (λ1={lam1}, λ2={lam2}, VAF Pre-filtered)')
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'{patient}_trees_fractions_{lam1}_{lam2}_{read_depth}.png'), format='png', dpi=300, bbox_inches='tight')
-        plt.close()
+        ax.clear()
+        ax.plot(position2, obj2_frac_ordered, 'o-', color='tab:orange', label='trees-fractions')
+        ax.set_xticks(position2)
+        ax.set_xticklabels(selected_markers2_genename_ordered, rotation=30)
+        ax.legend()
+        ax.set_title(f'Patient {patient} - Tree Fractions (λ1={lam1}, λ2={lam2}, VAF Pre-filtered)')
+        fig.tight_layout()
+        fig.savefig(os.path.join(output_dir, f'{patient}_trees_fractions_{lam1}_{lam2}_{read_depth}.png'), format='png', dpi=300, bbox_inches='tight')
 
         # Plot structures
-        plt.figure(figsize=(8, 5))
-        plt.plot(position2, obj2_struct_ordered, 'o-', color='tab:green', label='trees-structure')
-        plt.xticks(position2, selected_markers2_genename_ordered, rotation=30)
-        plt.legend()
-        plt.title(f'Patient {patient} - Tree Structures (λ1={lam1}, λ2={lam2}, VAF Pre-filtered)')
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'{patient}_trees_structures_{lam1}_{lam2}_{read_depth}.png'), format='png', dpi=300, bbox_inches='tight')
-        plt.close()
+        ax.clear()
+        ax.plot(position2, obj2_struct_ordered, 'o-', color='tab:green', label='trees-structure')
+        ax.set_xticks(position2)
+        ax.set_xticklabels(selected_markers2_genename_ordered, rotation=30)
+        ax.legend()
+        ax.set_title(f'Patient {patient} - Tree Structures (λ1={lam1}, λ2={lam2}, VAF Pre-filtered)')
+        fig.tight_layout()
+        fig.savefig(os.path.join(output_dir, f'{patient}_trees_structures_{lam1}_{lam2}_{read_depth}.png'), format='png', dpi=300, bbox_inches='tight')
+
+    plt.close(fig)
+
+    # Record the completed run so reruns on unchanged inputs can be skipped
+    with open(done_marker, 'w') as f:
+        f.write(fingerprint + "\n")
 
     print(f"\nMarker selection completed successfully!")
     print(f"Results saved to: {results_file}")